@@ -1,15 +1,25 @@
 """The profiler integration."""
 import asyncio
+from collections import Counter
+from collections.abc import Awaitable, Callable
 from contextlib import suppress
-from datetime import timedelta
+from datetime import datetime, timedelta
 from functools import _lru_cache_wrapper
+import gc
+import heapq
+import importlib
+import inspect
+import io
 import logging
+from operator import itemgetter
+import os
 import reprlib
 import sys
 import threading
 import time
 import traceback
-from typing import Any, cast
+from types import ModuleType
+from typing import Any
 
 from lru import LRU  # pylint: disable=no-name-in-module
 import voluptuous as vol
@@ -17,7 +27,7 @@ import voluptuous as vol
 from homeassistant.components import persistent_notification
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import CONF_SCAN_INTERVAL, CONF_TYPE
-from homeassistant.core import HomeAssistant, ServiceCall
+from homeassistant.core import HomeAssistant, ServiceCall, callback
 from homeassistant.exceptions import HomeAssistantError
 import homeassistant.helpers.config_validation as cv
 from homeassistant.helpers.event import async_track_time_interval
@@ -34,16 +44,16 @@ SERVICE_LRU_STATS = "lru_stats"
 SERVICE_LOG_THREAD_FRAMES = "log_thread_frames"
 SERVICE_LOG_EVENT_LOOP_SCHEDULED = "log_event_loop_scheduled"
 
-_LRU_CACHE_WRAPPER_OBJECT = _lru_cache_wrapper.__name__
-
-_KNOWN_LRU_CLASSES = (
-    "EventDataManager",
-    "EventTypeManager",
-    "StatesMetaManager",
-    "StateAttributesManager",
-    "StatisticsMetaManager",
-    "DomainData",
-    "IntegrationMatcher",
+_KNOWN_LRU_CLASSES = frozenset(
+    {
+        "EventDataManager",
+        "EventTypeManager",
+        "StatesMetaManager",
+        "StateAttributesManager",
+        "StatisticsMetaManager",
+        "DomainData",
+        "IntegrationMatcher",
+    }
 )
 
 SERVICES = (
@@ -59,26 +69,82 @@ SERVICES = (
 
 DEFAULT_SCAN_INTERVAL = timedelta(seconds=30)
 
+_DUMP_REPR = reprlib.Repr()
+_DUMP_REPR.maxstring = 300
+_DUMP_REPR.maxother = 300
+_DUMP_REPR.maxdict = 10
+
 CONF_SECONDS = "seconds"
+CONF_GENERATION = "generation"
 
 LOG_INTERVAL_SUB = "log_interval_subscription"
 
+GROWTH_LIMIT = 1000
+
+SECONDS_SCHEMA = vol.Schema(
+    {vol.Optional(CONF_SECONDS, default=60.0): vol.Coerce(float)}
+)
+
+START_LOG_OBJECTS_SCHEMA = vol.Schema(
+    {vol.Optional(CONF_SCAN_INTERVAL, default=DEFAULT_SCAN_INTERVAL): cv.time_period}
+)
+
+DUMP_LOG_OBJECTS_SCHEMA = vol.Schema({vol.Required(CONF_TYPE): str})
+
+LRU_STATS_SCHEMA = vol.Schema(
+    {vol.Optional(CONF_GENERATION): vol.All(vol.Coerce(int), vol.Range(min=0, max=2))}
+)
+
 
 _LOGGER = logging.getLogger(__name__)
 
+_LAZY_MODULES: dict[str, ModuleType] = {}
+
+# Peak number of objects seen per type name, used to compute the growth
+_PEAK_TYPE_COUNTS: Counter[str] = Counter()
+
+
+def _lazy_import(name: str) -> ModuleType:
+    """Import a module on first use and cache it.
+
+    Imports are deferred to avoid loading modules in memory since
+    usually only one part of this integration is used at a time.
+    """
+    if (module := _LAZY_MODULES.get(name)) is None:
+        module = _LAZY_MODULES[name] = importlib.import_module(name)
+    return module
+
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Set up Profiler from a config entry."""
-    lock = asyncio.Lock()
     domain_data = hass.data[DOMAIN] = {}
+    profile_running = False
+
+    async def _async_run_exclusive(
+        profile_func: Callable[[HomeAssistant, ServiceCall], Awaitable[None]],
+        call: ServiceCall,
+    ) -> None:
+        """Run a profile unless one is already running."""
+        nonlocal profile_running
+        if profile_running:
+            raise HomeAssistantError("A profile is already running")
+        profile_running = True
+        try:
+            await profile_func(hass, call)
+        finally:
+            profile_running = False
 
     async def _async_run_profile(call: ServiceCall) -> None:
-        async with lock:
-            await _async_generate_profile(hass, call)
+        await _async_run_exclusive(_async_generate_profile, call)
 
     async def _async_run_memory_profile(call: ServiceCall) -> None:
-        async with lock:
-            await _async_generate_memory_profile(hass, call)
+        await _async_run_exclusive(_async_generate_memory_profile, call)
+
+    @callback
+    def _async_log_objects(now: datetime) -> None:
+        # Walking the heap can take a long time so it
+        # must never be done in the event loop
+        hass.async_add_executor_job(_log_objects)
 
     async def _async_start_log_objects(call: ServiceCall) -> None:
         if LOG_INTERVAL_SUB in domain_data:
@@ -95,7 +161,7 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         )
         await hass.async_add_executor_job(_log_objects)
         domain_data[LOG_INTERVAL_SUB] = async_track_time_interval(
-            hass, _log_objects, call.data[CONF_SCAN_INTERVAL]
+            hass, _async_log_objects, call.data[CONF_SCAN_INTERVAL]
         )
 
     async def _async_stop_log_objects(call: ServiceCall) -> None:
@@ -105,32 +171,12 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         persistent_notification.async_dismiss(hass, "profile_object_logging")
         domain_data.pop(LOG_INTERVAL_SUB)()
 
-    def _safe_repr(obj: Any) -> str:
-        """Get the repr of an object but keep going if there is an exception.
-
-        We wrap repr to ensure if one object cannot be serialized, we can
-        still get the rest.
-        """
-        try:
-            return repr(obj)
-        except Exception:  # pylint: disable=broad-except
-            return f"Failed to serialize {type(obj)}"
-
-    def _dump_log_objects(call: ServiceCall) -> None:
-        # Imports deferred to avoid loading modules
-        # in memory since usually only one part of this
-        # integration is used at a time
-        import objgraph  # pylint: disable=import-outside-toplevel
-
+    async def _async_dump_log_objects(call: ServiceCall) -> None:
         obj_type = call.data[CONF_TYPE]
 
-        _LOGGER.critical(
-            "%s objects in memory: %s",
-            obj_type,
-            [_safe_repr(obj) for obj in objgraph.by_type(obj_type)],
-        )
+        await hass.async_add_executor_job(_log_objects_of_type, obj_type)
 
-        persistent_notification.create(
+        persistent_notification.async_create(
             hass,
             (
                 f"Objects with type {obj_type} have been dumped to the log. See [the"
@@ -140,41 +186,23 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
             notification_id="profile_object_dump",
         )
 
-    def _get_function_absfile(func: Any) -> str:
-        """Get the absolute file path of a function."""
-        import inspect  # pylint: disable=import-outside-toplevel
-
-        abs_file = "unknown"
-        with suppress(Exception):
-            abs_file = inspect.getabsfile(func)
-        return abs_file
-
     def _lru_stats(call: ServiceCall) -> None:
         """Log the stats of all lru caches."""
-        # Imports deferred to avoid loading modules
-        # in memory since usually only one part of this
-        # integration is used at a time
-        import objgraph  # pylint: disable=import-outside-toplevel
-
-        for lru in objgraph.by_type(_LRU_CACHE_WRAPPER_OBJECT):
-            lru = cast(_lru_cache_wrapper, lru)
-            _LOGGER.critical(
-                "Cache stats for lru_cache %s at %s: %s",
-                lru.__wrapped__,
-                _get_function_absfile(lru.__wrapped__),
-                lru.cache_info(),
+        # Skip walking the heap and collecting the cache info
+        # of every cache when nothing would be logged
+        if not _LOGGER.isEnabledFor(logging.CRITICAL):
+            persistent_notification.create(
+                hass,
+                (
+                    "LRU cache states were not dumped because critical logging is"
+                    f" disabled for {__name__}."
+                ),
+                title="LRU stats skipped",
+                notification_id="profile_lru_stats",
             )
+            return
 
-        for _class in _KNOWN_LRU_CLASSES:
-            for class_with_lru_attr in objgraph.by_type(_class):
-                for maybe_lru in class_with_lru_attr.__dict__.values():
-                    if isinstance(maybe_lru, LRU):
-                        _LOGGER.critical(
-                            "Cache stats for LRU %s at %s: %s",
-                            type(class_with_lru_attr),
-                            _get_function_absfile(class_with_lru_attr),
-                            maybe_lru.get_stats(),
-                        )
+        _log_lru_stats(call.data.get(CONF_GENERATION))
 
         persistent_notification.create(
             hass,
@@ -188,30 +216,37 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
 
     async def _async_dump_thread_frames(call: ServiceCall) -> None:
         """Log all thread frames."""
-        frames = sys._current_frames()  # pylint: disable=protected-access
-        main_thread = threading.main_thread()
-        for thread in threading.enumerate():
-            if thread == main_thread:
+        main_thread_ident = threading.main_thread().ident
+        threads = {thread.ident: thread for thread in threading.enumerate()}
+        # pylint: disable-next=protected-access
+        for ident, frame in sys._current_frames().items():
+            if ident == main_thread_ident:
                 continue
-            ident = cast(int, thread.ident)
+            thread = threads.get(ident)
             _LOGGER.critical(
                 "Thread [%s]: %s",
-                thread.name,
-                "".join(traceback.format_stack(frames.get(ident))).strip(),
+                thread.name if thread else ident,
+                "".join(traceback.format_stack(frame)).strip(),
             )
 
     async def _async_dump_scheduled(call: ServiceCall) -> None:
         """Log all scheduled in the event loop."""
+        # The handles are formatted in the event loop because the
+        # reprlib limits below are process-global and must not be
+        # changed from a thread while the event loop may be using them
+        scheduled: list[asyncio.TimerHandle] = [
+            handle
+            for handle in getattr(hass.loop, "_scheduled")
+            if not handle.cancelled()
+        ]
         arepr = reprlib.aRepr
         original_maxstring = arepr.maxstring
         original_maxother = arepr.maxother
         arepr.maxstring = 300
         arepr.maxother = 300
-        handle: asyncio.Handle
         try:
-            for handle in getattr(hass.loop, "_scheduled"):
-                if not handle.cancelled():
-                    _LOGGER.critical("Scheduled: %s", handle)
+            for handle in scheduled:
+                _LOGGER.critical("Scheduled: %s", handle)
         finally:
             arepr.maxstring = original_maxstring
             arepr.maxother = original_maxother
@@ -221,9 +256,7 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         DOMAIN,
         SERVICE_START,
         _async_run_profile,
-        schema=vol.Schema(
-            {vol.Optional(CONF_SECONDS, default=60.0): vol.Coerce(float)}
-        ),
+        schema=SECONDS_SCHEMA,
     )
 
     async_register_admin_service(
@@ -231,9 +264,7 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         DOMAIN,
         SERVICE_MEMORY,
         _async_run_memory_profile,
-        schema=vol.Schema(
-            {vol.Optional(CONF_SECONDS, default=60.0): vol.Coerce(float)}
-        ),
+        schema=SECONDS_SCHEMA,
     )
 
     async_register_admin_service(
@@ -241,13 +272,7 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         DOMAIN,
         SERVICE_START_LOG_OBJECTS,
         _async_start_log_objects,
-        schema=vol.Schema(
-            {
-                vol.Optional(
-                    CONF_SCAN_INTERVAL, default=DEFAULT_SCAN_INTERVAL
-                ): cv.time_period
-            }
-        ),
+        schema=START_LOG_OBJECTS_SCHEMA,
     )
 
     async_register_admin_service(
@@ -261,8 +286,8 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         hass,
         DOMAIN,
         SERVICE_DUMP_LOG_OBJECTS,
-        _dump_log_objects,
-        schema=vol.Schema({vol.Required(CONF_TYPE): str}),
+        _async_dump_log_objects,
+        schema=DUMP_LOG_OBJECTS_SCHEMA,
     )
 
     async_register_admin_service(
@@ -270,6 +295,7 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         DOMAIN,
         SERVICE_LRU_STATS,
         _lru_stats,
+        schema=LRU_STATS_SCHEMA,
     )
 
     async_register_admin_service(
@@ -299,11 +325,8 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     return True
 
 
-async def _async_generate_profile(hass: HomeAssistant, call: ServiceCall):
-    # Imports deferred to avoid loading modules
-    # in memory since usually only one part of this
-    # integration is used at a time
-    import cProfile  # pylint: disable=import-outside-toplevel
+async def _async_generate_profile(hass: HomeAssistant, call: ServiceCall) -> None:
+    cprofile = _lazy_import("cProfile")
 
     start_time = int(time.time() * 1000000)
     persistent_notification.async_create(
@@ -315,7 +338,7 @@ async def _async_generate_profile(hass: HomeAssistant, call: ServiceCall):
         title="Profile Started",
         notification_id=f"profiler_{start_time}",
     )
-    profiler = cProfile.Profile()
+    profiler = cprofile.Profile()
     profiler.enable()
     await asyncio.sleep(float(call.data[CONF_SECONDS]))
     profiler.disable()
@@ -336,16 +359,15 @@ async def _async_generate_profile(hass: HomeAssistant, call: ServiceCall):
     )
 
 
-async def _async_generate_memory_profile(hass: HomeAssistant, call: ServiceCall):
-    # Imports deferred to avoid loading modules
-    # in memory since usually only one part of this
-    # integration is used at a time
+async def _async_generate_memory_profile(
+    hass: HomeAssistant, call: ServiceCall
+) -> None:
     if sys.version_info >= (3, 11):
         raise HomeAssistantError(
             "Memory profiling is not supported on Python 3.11. Please use Python 3.10."
         )
 
-    from guppy import hpy  # pylint: disable=import-outside-toplevel
+    guppy = _lazy_import("guppy")
 
     start_time = int(time.time() * 1000000)
     persistent_notification.async_create(
@@ -357,7 +379,7 @@ async def _async_generate_memory_profile(hass: HomeAssistant, call: ServiceCall)
         title="Profile Started",
         notification_id=f"memory_profiler_{start_time}",
     )
-    heap_profiler = hpy()
+    heap_profiler = guppy.hpy()
     heap_profiler.setref()
     await asyncio.sleep(float(call.data[CONF_SECONDS]))
     heap = heap_profiler.heap()
@@ -373,24 +395,135 @@ async def _async_generate_memory_profile(hass: HomeAssistant, call: ServiceCall)
 
 
 def _write_profile(profiler, cprofile_path, callgrind_path):
-    # Imports deferred to avoid loading modules
-    # in memory since usually only one part of this
-    # integration is used at a time
-    from pyprof2calltree import convert  # pylint: disable=import-outside-toplevel
+    pyprof2calltree = _lazy_import("pyprof2calltree")
 
-    profiler.create_stats()
+    # dump_stats creates the pstats data itself, drop it once written so
+    # it is not kept alive alongside the entries used for the callgrind data
     profiler.dump_stats(cprofile_path)
-    convert(profiler.getstats(), callgrind_path)
+    del profiler.stats
+    pyprof2calltree.convert(profiler.getstats(), callgrind_path)
 
 
 def _write_memory_profile(heap, heap_path):
-    heap.byrcs.dump(heap_path)
-
-
-def _log_objects(*_):
-    # Imports deferred to avoid loading modules
-    # in memory since usually only one part of this
-    # integration is used at a time
-    import objgraph  # pylint: disable=import-outside-toplevel
+    # The dump is written one row at a time so use a large write buffer
+    with open(heap_path, "w", buffering=1 << 20, encoding="utf-8") as heap_file:
+        heap.byrcs.dump(heap_file)
+
+
+def _get_function_absfile(func: Any) -> str:
+    """Get the absolute file path of a function."""
+    code = getattr(func, "__code__", None)
+    # Avoid the lookups inspect does when the filename is already absolute
+    if code is not None and os.path.isabs(code.co_filename):
+        return code.co_filename
+    return _get_absfile(func)
+
+
+def _get_class_absfile(class_type: type, cache: dict[type, str]) -> str:
+    """Get the absolute file path of a class, memoized in cache."""
+    if (abs_file := cache.get(class_type)) is None:
+        abs_file = cache[class_type] = _get_absfile(class_type)
+    return abs_file
+
+
+def _get_absfile(obj: Any) -> str:
+    """Get the absolute file path of an object with inspect."""
+    abs_file = "unknown"
+    with suppress(Exception):
+        abs_file = inspect.getabsfile(obj)
+    return abs_file
+
+
+def _safe_repr(obj: Any) -> str:
+    """Get the bounded repr of an object.
+
+    reprlib falls back to a placeholder when the repr of an object
+    raises, so one object that cannot be serialized does not stop
+    the rest. The output is bounded so large objects do not flood
+    the log.
+    """
+    return _DUMP_REPR.repr(obj)
+
+
+def _log_objects_of_type(obj_type: str) -> None:
+    """Log the repr of all objects of a type."""
+    objgraph = _lazy_import("objgraph")
+
+    # Stream the reprs into a buffer instead of building
+    # a list of them that is only used to create the message
+    buffer = io.StringIO()
+    buffer.write("[")
+    for idx, obj in enumerate(objgraph.by_type(obj_type)):
+        if idx:
+            buffer.write(", ")
+        buffer.write(_safe_repr(obj))
+    buffer.write("]")
+
+    _LOGGER.critical("%s objects in memory: %s", obj_type, buffer.getvalue())
+
+
+def _log_lru_stats(generation: int | None) -> None:
+    """Log the stats of all lru caches."""
+    lru_wrappers_by_wrapped_id: dict[int, list[_lru_cache_wrapper]] = {}
+    objects_by_type_name: dict[str, list[Any]] = {}
+    # Walk the heap once. The type of the lru_cache wrappers is known
+    # so it is compared by identity instead of by name.
+    for obj in gc.get_objects(generation):
+        if (obj_type := type(obj)) is _lru_cache_wrapper:
+            lru_wrappers_by_wrapped_id.setdefault(id(obj.__wrapped__), []).append(obj)
+        elif (type_name := obj_type.__name__) in _KNOWN_LRU_CLASSES:
+            objects_by_type_name.setdefault(type_name, []).append(obj)
+
+    # The same function can be wrapped by more than one cache so
+    # the caches are grouped to report each function only once
+    for lru_wrappers in lru_wrappers_by_wrapped_id.values():
+        wrapped = lru_wrappers[0].__wrapped__
+        _LOGGER.critical(
+            "Cache stats for lru_cache %s at %s: %s",
+            wrapped,
+            _get_function_absfile(wrapped),
+            ", ".join(str(lru.cache_info()) for lru in lru_wrappers),
+        )
 
-    _LOGGER.critical("Memory Growth: %s", objgraph.growth(limit=1000))
+    lru_type = LRU
+    # The attributes holding an LRU are the same for every instance
+    # of a class so they are only discovered once per class
+    lru_attrs_by_type: dict[type, tuple[str, ...]] = {}
+    class_abs_file_cache: dict[type, str] = {}
+    # Only classes that have live instances are present in the buckets
+    for class_instances in objects_by_type_name.values():
+        for class_with_lru_attr in class_instances:
+            class_type = type(class_with_lru_attr)
+            if (lru_attrs := lru_attrs_by_type.get(class_type)) is None:
+                lru_attrs = lru_attrs_by_type[class_type] = tuple(
+                    attr
+                    for attr, maybe_lru in class_with_lru_attr.__dict__.items()
+                    if isinstance(maybe_lru, lru_type)
+                )
+            for attr in lru_attrs:
+                maybe_lru = getattr(class_with_lru_attr, attr, None)
+                if isinstance(maybe_lru, lru_type):
+                    _LOGGER.critical(
+                        "Cache stats for LRU %s at %s: %s",
+                        class_type,
+                        _get_class_absfile(class_type, class_abs_file_cache),
+                        maybe_lru.get_stats(),
+                    )
+
+
+def _log_objects() -> None:
+    """Log the types whose number of objects grew since their last peak.
+
+    This runs in the executor.
+    """
+    gc.collect()
+    type_counts = Counter(type(obj).__name__ for obj in gc.get_objects())
+    growth: list[tuple[str, int, int]] = []
+    for type_name, count in type_counts.items():
+        if (delta := count - _PEAK_TYPE_COUNTS[type_name]) > 0:
+            _PEAK_TYPE_COUNTS[type_name] = count
+            growth.append((type_name, count, delta))
+
+    _LOGGER.critical(
+        "Memory Growth: %s", heapq.nlargest(GROWTH_LIMIT, growth, key=itemgetter(2))
+    )
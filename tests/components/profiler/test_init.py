@@ -1,7 +1,9 @@
 """Test the Profiler config flow."""
+import asyncio
 from datetime import timedelta
-from functools import lru_cache
+from functools import lru_cache, partial
 import os
+import reprlib
 import sys
 from unittest.mock import patch
 
@@ -10,7 +12,7 @@ import py
 import pytest
 
 from homeassistant.components.profiler import (
-    _LRU_CACHE_WRAPPER_OBJECT,
+    CONF_GENERATION,
     CONF_SECONDS,
     SERVICE_DUMP_LOG_OBJECTS,
     SERVICE_LOG_EVENT_LOOP_SCHEDULED,
@@ -60,6 +62,42 @@ async def test_basic_usage(hass: HomeAssistant, tmpdir: py.path.local) -> None:
     await hass.async_block_till_done()
 
 
+async def test_profile_already_running(hass: HomeAssistant) -> None:
+    """Test starting a profile while another one is running fails fast."""
+    entry = MockConfigEntry(domain=DOMAIN)
+    entry.add_to_hass(hass)
+
+    assert await hass.config_entries.async_setup(entry.entry_id)
+    await hass.async_block_till_done()
+
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def _mock_generate_profile(*_):
+        started.set()
+        await release.wait()
+
+    with patch(
+        "homeassistant.components.profiler._async_generate_profile",
+        _mock_generate_profile,
+    ):
+        task = hass.async_create_task(
+            hass.services.async_call(DOMAIN, SERVICE_START, {}, blocking=True)
+        )
+        await started.wait()
+
+        with pytest.raises(HomeAssistantError, match="already running"):
+            await hass.services.async_call(DOMAIN, SERVICE_START, {}, blocking=True)
+        with pytest.raises(HomeAssistantError, match="already running"):
+            await hass.services.async_call(DOMAIN, SERVICE_MEMORY, {}, blocking=True)
+
+        release.set()
+        await task
+
+    assert await hass.config_entries.async_unload(entry.entry_id)
+    await hass.async_block_till_done()
+
+
 @pytest.mark.skipif(
     sys.version_info >= (3, 11), reason="not yet available on python 3.11"
 )
@@ -125,17 +163,23 @@ async def test_object_growth_logging(
     assert hass.services.has_service(DOMAIN, SERVICE_START_LOG_OBJECTS)
     assert hass.services.has_service(DOMAIN, SERVICE_STOP_LOG_OBJECTS)
 
-    with patch("objgraph.growth"):
-        await hass.services.async_call(
-            DOMAIN, SERVICE_START_LOG_OBJECTS, {CONF_SCAN_INTERVAL: 10}, blocking=True
-        )
+    await hass.services.async_call(
+        DOMAIN, SERVICE_START_LOG_OBJECTS, {CONF_SCAN_INTERVAL: 10}, blocking=True
+    )
 
     assert "Growth" in caplog.text
     caplog.clear()
 
+    class GrowthDummy:
+        pass
+
+    growth_dummies = [GrowthDummy() for _ in range(5)]
+
     async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=11))
     await hass.async_block_till_done()
     assert "Growth" in caplog.text
+    assert "('GrowthDummy', 5, 5)" in caplog.text
+    del growth_dummies
 
     await hass.services.async_call(DOMAIN, SERVICE_STOP_LOG_OBJECTS, {}, blocking=True)
     caplog.clear()
@@ -172,8 +216,13 @@ async def test_dump_log_object(
                 raise Exception("failed")
             return "<DumpLogDummy success>"
 
+    class DumpLogLargeDummy:
+        def __repr__(self):
+            return "<DumpLogLargeDummy " + "x" * 1000 + ">"
+
     obj1 = DumpLogDummy(False)
     obj2 = DumpLogDummy(True)
+    obj3 = DumpLogLargeDummy()
 
     assert hass.services.has_service(DOMAIN, SERVICE_DUMP_LOG_OBJECTS)
 
@@ -182,9 +231,21 @@ async def test_dump_log_object(
     )
 
     assert "<DumpLogDummy success>" in caplog.text
-    assert "Failed to serialize" in caplog.text
+    assert "<DumpLogDummy instance at" in caplog.text
+    caplog.clear()
+
+    await hass.services.async_call(
+        DOMAIN,
+        SERVICE_DUMP_LOG_OBJECTS,
+        {CONF_TYPE: "DumpLogLargeDummy"},
+        blocking=True,
+    )
+
+    assert "<DumpLogLargeDummy" in caplog.text
+    assert "x" * 1000 not in caplog.text
     del obj1
     del obj2
+    del obj3
     caplog.clear()
 
 
@@ -223,11 +284,20 @@ async def test_log_scheduled(
 
     assert hass.services.has_service(DOMAIN, SERVICE_LOG_EVENT_LOOP_SCHEDULED)
 
+    original_maxstring = reprlib.aRepr.maxstring
+    original_maxother = reprlib.aRepr.maxother
+    handle = hass.loop.call_later(1000, lambda _: None, "x" * 1000)
+
     await hass.services.async_call(
         DOMAIN, SERVICE_LOG_EVENT_LOOP_SCHEDULED, {}, blocking=True
     )
+    handle.cancel()
 
     assert "Scheduled" in caplog.text
+    assert "x" * 100 in caplog.text
+    assert "x" * 1000 not in caplog.text
+    assert reprlib.aRepr.maxstring == original_maxstring
+    assert reprlib.aRepr.maxother == original_maxother
     caplog.clear()
 
     assert await hass.config_entries.async_unload(entry.entry_id)
@@ -252,17 +322,85 @@ async def test_lru_stats(hass: HomeAssistant, caplog: pytest.LogCaptureFixture)
             self._data = LRU(1)
 
     domain_data = DomainData()
+    other_domain_data = DomainData()
     assert hass.services.has_service(DOMAIN, SERVICE_LRU_STATS)
 
-    def _mock_by_type(type_):
-        if type_ == _LRU_CACHE_WRAPPER_OBJECT:
-            return [_dummy_test_lru_stats]
-        return [domain_data]
-
-    with patch("objgraph.by_type", side_effect=_mock_by_type):
+    with patch(
+        "homeassistant.components.profiler.gc.get_objects",
+        return_value=[_dummy_test_lru_stats, domain_data, other_domain_data],
+    ):
         await hass.services.async_call(DOMAIN, SERVICE_LRU_STATS, blocking=True)
 
     assert "DomainData" in caplog.text
+    assert caplog.text.count("Cache stats for LRU") == 2
+    for line in caplog.text.splitlines():
+        if "Cache stats for LRU" in line:
+            assert f"at {os.path.abspath(__file__)}:" in line
     assert "(0, 0)" in caplog.text
     assert "_dummy_test_lru_stats" in caplog.text
     assert "CacheInfo" in caplog.text
+    caplog.clear()
+
+    with patch(
+        "homeassistant.components.profiler.gc.get_objects",
+        return_value=[_dummy_test_lru_stats],
+    ) as mock_get_objects:
+        await hass.services.async_call(
+            DOMAIN, SERVICE_LRU_STATS, {CONF_GENERATION: 2}, blocking=True
+        )
+
+    mock_get_objects.assert_called_once_with(2)
+    assert "_dummy_test_lru_stats" in caplog.text
+    caplog.clear()
+
+    def _dummy_test_lru_stats_shared():
+        return 1
+
+    first_lru = lru_cache(maxsize=1)(_dummy_test_lru_stats_shared)
+    second_lru = lru_cache(maxsize=2)(_dummy_test_lru_stats_shared)
+
+    with patch(
+        "homeassistant.components.profiler.gc.get_objects",
+        return_value=[first_lru, second_lru],
+    ):
+        await hass.services.async_call(DOMAIN, SERVICE_LRU_STATS, blocking=True)
+
+    assert caplog.text.count("_dummy_test_lru_stats_shared") == 1
+    assert "maxsize=1" in caplog.text
+    assert "maxsize=2" in caplog.text
+    caplog.clear()
+
+    partial_lru = lru_cache(maxsize=1)(partial(_dummy_test_lru_stats_shared))
+
+    with patch(
+        "homeassistant.components.profiler.gc.get_objects",
+        return_value=[partial_lru],
+    ):
+        await hass.services.async_call(DOMAIN, SERVICE_LRU_STATS, blocking=True)
+
+    assert "functools.partial" in caplog.text
+    assert "functools.py" not in caplog.text
+    assert "at unknown" in caplog.text
+
+
+async def test_lru_stats_logging_disabled(hass: HomeAssistant) -> None:
+    """Test the heap is not walked when the stats would not be logged."""
+
+    entry = MockConfigEntry(domain=DOMAIN)
+    entry.add_to_hass(hass)
+
+    assert await hass.config_entries.async_setup(entry.entry_id)
+    await hass.async_block_till_done()
+
+    with patch(
+        "homeassistant.components.profiler._LOGGER.isEnabledFor", return_value=False
+    ), patch(
+        "homeassistant.components.profiler.gc.get_objects"
+    ) as mock_get_objects, patch(
+        "homeassistant.components.profiler.persistent_notification.create"
+    ) as mock_create_notification:
+        await hass.services.async_call(DOMAIN, SERVICE_LRU_STATS, blocking=True)
+
+    mock_get_objects.assert_not_called()
+    mock_create_notification.assert_called_once()
+    assert mock_create_notification.call_args.kwargs["title"] == "LRU stats skipped"